@@ -1,9 +1,13 @@
 # app: MaiRestaurantData.py
+import io
 import os
 import streamlit as st
 import pandas as pd
 import numpy as np
 import plotly.express as px
+import plotly.graph_objects as go
+from numba import njit
+from streamlit.runtime.uploaded_file_manager import UploadedFile
 
 st.set_page_config(page_title="MSY Inventory Intelligence", layout="wide")
 st.title("🍜 Mai Shan Yun — Inventory Intelligence")
@@ -21,37 +25,41 @@ def fail(msg, exc=None):
 
 # ---------- Cleaners ----------
 def normalize_month(col):
-    m = pd.to_datetime(col, errors="coerce")
-    if m.isna().all():
-        m = pd.to_datetime(col.astype(str) + " 1, 2025", errors="coerce")
+    s = col.astype("string")
+    # cache=True memoizes repeated strings — Month has only ~12 distinct values
+    m = pd.to_datetime(s, errors="coerce", cache=True, format="mixed")
+    mask = m.isna() & s.notna()
+    if mask.any():
+        # bare month names ("January" / "Jan"), same year assumption as before
+        rest = s[mask] + " 2025"
+        m2 = pd.to_datetime(rest, format="%B %Y", errors="coerce", cache=True)
+        m[mask] = m2.fillna(pd.to_datetime(rest, format="%b %Y", errors="coerce", cache=True))
     return m.dt.to_period("M").dt.to_timestamp()
 
+@st.cache_data(show_spinner=False)
 def clean_sales(df):
-    df = df.copy()
+    # no df.copy(): the raw frame comes out of st.cache_data, nothing else shares it
     df.columns = [c.strip() for c in df.columns]
 
     # Map common variants
     col_map = {"item name":"Item Name", "item":"Item Name", "qty":"Count", "quantity":"Count"}
-    for c in list(df.columns):
-        lc = c.lower()
-        if lc in col_map:
-            df.rename(columns={c: col_map[lc]}, inplace=True)
+    rename = {c: col_map[c.lower()] for c in df.columns if c.lower() in col_map}
+    if rename: df = df.rename(columns=rename)
 
     if "Month" not in df.columns: fail("Sales sheet is missing a 'Month' column.")
     df["Month"] = normalize_month(df["Month"])
 
-    df["Amount"] = (df.get("Amount", 0).astype(str)
-                    .str.replace("$", "", regex=False)
-                    .str.replace(",", "", regex=False))
-    df["Amount"] = pd.to_numeric(df["Amount"], errors="coerce").fillna(0.0)
+    amt = df.get("Amount", 0).astype("string").str.replace(r"[$,]", "", regex=True)
+    df["Amount"] = pd.to_numeric(amt, errors="coerce").fillna(0.0).astype(np.float32)
 
     if "Count" not in df.columns: fail("Sales sheet is missing a 'Count' column.")
-    df["Count"] = pd.to_numeric(df["Count"], errors="coerce").fillna(0)
+    df["Count"] = pd.to_numeric(df["Count"], errors="coerce").fillna(0).astype(np.int32)
     if "Item Name" not in df.columns: fail("Sales sheet is missing an 'Item Name' column.")
+    df["Item Name"] = df["Item Name"].astype("category")
     return df
 
+@st.cache_data(show_spinner=False)
 def clean_ingredient_map(df):
-    df = df.copy()
     df.columns = [str(c).strip() for c in df.columns]
     low2orig = {c.lower(): c for c in df.columns}
 
@@ -71,15 +79,16 @@ def clean_ingredient_map(df):
     if missing:
         fail(f"Ingredient map missing columns: {missing}\nFound: {list(df.columns)}")
 
-    df.rename(columns={item_col:"Item Name", ingr_col:"Ingredient", units_col:"Units per Item"}, inplace=True)
+    df = df.rename(columns={item_col:"Item Name", ingr_col:"Ingredient", units_col:"Units per Item"})
     for c in ["Item Name","Ingredient"]: df[c] = df[c].astype(str).str.strip()
-    df = df.replace({"":np.nan}).dropna(subset=["Item Name","Ingredient"]).copy()
-    df["Units per Item"] = pd.to_numeric(df["Units per Item"], errors="coerce").fillna(0.0)
+    df = df.replace({"":np.nan}).dropna(subset=["Item Name","Ingredient"])
+    df["Units per Item"] = pd.to_numeric(df["Units per Item"], errors="coerce").fillna(0.0).astype(np.float32)
     df = df.groupby(["Item Name","Ingredient"], as_index=False).agg({"Units per Item":"max"})
+    for c in ["Item Name","Ingredient"]: df[c] = df[c].astype("category")
     return df
 
+@st.cache_data(show_spinner=False)
 def clean_shipments(df):
-    df = df.copy()
     df.columns = [c.strip() for c in df.columns]
     rename = {}
     for c in df.columns:
@@ -88,88 +97,204 @@ def clean_shipments(df):
         elif lc == "unit of shipment":    rename[c] = "Unit"
         elif lc == "number of shipments": rename[c] = "NumShipments"
         elif lc == "frequency":           rename[c] = "Frequency"
-    if rename: df.rename(columns=rename, inplace=True)
+    if rename: df = df.rename(columns=rename)
 
     needed = ["Ingredient","QtyPerShipment","NumShipments"]
     miss = [c for c in needed if c not in df.columns]
     if miss: fail(f"Shipment sheet missing columns: {miss}\nFound: {list(df.columns)}")
 
-    df["QtyPerShipment"] = pd.to_numeric(df["QtyPerShipment"], errors="coerce").fillna(0.0)
-    df["NumShipments"]   = pd.to_numeric(df["NumShipments"], errors="coerce").fillna(0.0)
+    df["QtyPerShipment"] = pd.to_numeric(df["QtyPerShipment"], errors="coerce").fillna(0.0).astype(np.float32)
+    df["NumShipments"]   = pd.to_numeric(df["NumShipments"], errors="coerce").fillna(0.0).astype(np.float32)
     df["TotalReceived"]  = df["QtyPerShipment"] * df["NumShipments"]
     f = df.get("Frequency","weekly").astype(str).str.lower().str.strip()
-    factor = np.where(f.eq("weekly"),1.0, np.where(f.eq("biweekly"),0.5, np.where(f.eq("monthly"),0.25,1.0)))
-    df["WeeklySupply"] = df["TotalReceived"] * factor
+    factor = f.map({"weekly":1.0, "biweekly":0.5, "monthly":0.25}).fillna(1.0).to_numpy()
+    df["WeeklySupply"] = (df["TotalReceived"].to_numpy() * factor).astype(np.float32)
     if "Unit" not in df.columns: df["Unit"] = ""
+    df["Ingredient"] = df["Ingredient"].astype("category")
+    if "Frequency" in df.columns: df["Frequency"] = df["Frequency"].astype("category")
     return df
 
 # ---------- Load data ----------
 st.sidebar.header("Data Source")
 use_local = st.sidebar.toggle("Use local Excel (Restaurant Data.xlsx)", value=True)
 
+# lower-cased header variants the cleaners know how to normalize; anything
+# else is skipped at parse time instead of being materialized and discarded
+SALES_USECOLS = {"month","item name","item","qty","quantity","count","amount"}
+INGR_USECOLS  = {"item name","item","ingredient","ingrediant","ingredients",
+                 "units per item","units_per_item","unit per item"}
+SHIP_USECOLS  = {"ingredient","quantity per shipment","unit of shipment",
+                 "number of shipments","frequency"}
+
+def _keep(allowed):
+    return lambda c: (str(c).strip().lower() in allowed
+                      or str(c).strip().lower().startswith("units per item"))
+
+def _read_sheets(src):
+    if isinstance(src, bytes):
+        src = io.BytesIO(src)
+    # one ExcelFile amortizes the zip open across all three sheets, and the
+    # context manager closes the handle instead of leaking it on every rerun
+    with pd.ExcelFile(src, engine="calamine") as xls:
+        sales = pd.read_excel(xls, SALES_SHEET, usecols=_keep(SALES_USECOLS),
+                              dtype={"Item Name":"string","Amount":"string"})
+        ingr  = pd.read_excel(xls, INGR_SHEET, usecols=_keep(INGR_USECOLS),
+                              dtype={"Item Name":"string","Ingredient":"string"})
+        ship  = pd.read_excel(xls, SHIP_SHEET, usecols=_keep(SHIP_USECOLS),
+                              dtype={"Ingredient":"string","Frequency":"string"})
+    return sales, ingr, ship
+
+@st.cache_data(show_spinner="Loading workbook…")
+def _read_workbook(path, mtime):
+    # mtime is part of the cache key, so editing the file invalidates the cache
+    return _read_sheets(path)
+
+@st.cache_data(show_spinner="Loading workbook…",
+               hash_funcs={UploadedFile: lambda f: f.file_id})
+def _read_upload(wb):
+    return _read_sheets(wb.getvalue())
+
+PARQUET_CACHE = {
+    "sales": ".cache_sales.parquet",
+    "ingr":  ".cache_ingredients.parquet",
+    "ship":  ".cache_shipments.parquet",
+}
+
+def _load_parquet_cache():
+    # Reuse the cleaned frames from Parquet when they are newer than the workbook
+    paths = list(PARQUET_CACHE.values())
+    if not all(os.path.exists(p) for p in paths):
+        return None
+    xlsx_mtime = os.path.getmtime(FILE_NAME)
+    if any(os.path.getmtime(p) < xlsx_mtime for p in paths):
+        return None
+    try:
+        return tuple(pd.read_parquet(p) for p in paths)
+    except Exception:
+        return None
+
+def _write_parquet_cache(sales, ingr, ship):
+    try:
+        sales.to_parquet(PARQUET_CACHE["sales"])
+        ingr.to_parquet(PARQUET_CACHE["ingr"])
+        ship.to_parquet(PARQUET_CACHE["ship"])
+    except Exception:
+        pass  # cache is best-effort; next run just re-parses the Excel
+
 def load_from_local():
     if not os.path.exists(FILE_NAME):
         fail(f"'{FILE_NAME}' not found in: {os.getcwd()}\n"
              f"Tip: put the Excel next to this .py, or disable 'Use local Excel' and upload.")
     try:
-        xls = pd.ExcelFile(FILE_NAME)
-    except Exception as e:
-        fail("Could not open workbook. Is it closed in Excel?", e)
-    try:
-        sales = pd.read_excel(xls, SALES_SHEET)
-        ingr  = pd.read_excel(xls, INGR_SHEET)
-        ship  = pd.read_excel(xls, SHIP_SHEET)
+        return _read_workbook(FILE_NAME, os.path.getmtime(FILE_NAME))
     except Exception as e:
-        fail(f"Check sheet names. Expected: '{SALES_SHEET}', '{INGR_SHEET}', '{SHIP_SHEET}'.", e)
-    return sales, ingr, ship
+        fail(f"Could not read workbook. Is it closed in Excel? "
+             f"Expected sheets: '{SALES_SHEET}', '{INGR_SHEET}', '{SHIP_SHEET}'.", e)
 
 def load_from_upload():
     wb = st.sidebar.file_uploader("Upload workbook (.xlsx) with the three sheets", type=["xlsx"])
     if not wb: st.info("Upload an Excel file to continue."); st.stop()
     try:
-        xls = pd.ExcelFile(wb)
-        sales = pd.read_excel(xls, SALES_SHEET)
-        ingr  = pd.read_excel(xls, INGR_SHEET)
-        ship  = pd.read_excel(xls, SHIP_SHEET)
+        return _read_upload(wb)
     except Exception as e:
         fail(f"Upload must contain sheets: '{SALES_SHEET}', '{INGR_SHEET}', '{SHIP_SHEET}'.", e)
-    return sales, ingr, ship
 
-if use_local:
-    sales_raw, ingr_raw, ship_raw = load_from_local()
+cached = _load_parquet_cache() if use_local and os.path.exists(FILE_NAME) else None
+if cached:
+    sales, ingr, ship = cached
+    with st.expander("🔎 Debug: show loaded columns"):
+        st.write("Sales columns (cleaned, from Parquet cache):", list(sales.columns))
+        st.write("Ingredient columns (cleaned, from Parquet cache):", list(ingr.columns))
+        st.write("Shipment columns (cleaned, from Parquet cache):", list(ship.columns))
 else:
-    sales_raw, ingr_raw, ship_raw = load_from_upload()
-
-# Show what we actually loaded (helps kill “blank page”)
-with st.expander("🔎 Debug: show loaded columns"):
-    st.write("Sales columns:", list(sales_raw.columns))
-    st.write("Ingredient columns:", list(ingr_raw.columns))
-    st.write("Shipment columns:", list(ship_raw.columns))
-
-# ---------- Clean ----------
-sales = clean_sales(sales_raw)
-ingr  = clean_ingredient_map(ingr_raw)
-ship  = clean_shipments(ship_raw)
+    if use_local:
+        sales_raw, ingr_raw, ship_raw = load_from_local()
+    else:
+        sales_raw, ingr_raw, ship_raw = load_from_upload()
+
+    # Show what we actually loaded (helps kill “blank page”) — rendered before
+    # the cleaners so it still appears when one of them fails on bad headers
+    with st.expander("🔎 Debug: show loaded columns"):
+        st.write("Sales columns:", list(sales_raw.columns))
+        st.write("Ingredient columns:", list(ingr_raw.columns))
+        st.write("Shipment columns:", list(ship_raw.columns))
+
+    # ---------- Clean ----------
+    sales = clean_sales(sales_raw)
+    ingr  = clean_ingredient_map(ingr_raw)
+    ship  = clean_shipments(ship_raw)
+    if use_local:
+        _write_parquet_cache(sales, ingr, ship)
+
+@njit(cache=True)
+def _grouped_roll3_mean(vals, group_ids):
+    # single pass over arrays sorted by (group, month); the window restarts per group
+    n = vals.shape[0]
+    out = np.empty(n)
+    prev_g = -2
+    start = 0
+    s = 0.0
+    for i in range(n):
+        g = group_ids[i]
+        if g != prev_g:
+            prev_g = g
+            start = i
+            s = 0.0
+        s += vals[i]
+        if i - start >= 3:
+            s -= vals[i - 3]
+            out[i] = s / 3.0
+        else:
+            out[i] = s / (i - start + 1)
+    return out
 
 # ---------- Transform (sales -> ingredient usage) ----------
-usage = (sales.merge(ingr, on="Item Name", how="left")
-              .assign(IngredientUsage=lambda d: d["Count"] * d["Units per Item"])
-              .dropna(subset=["Ingredient"]))
-usage_by_month_ing = (usage.groupby(["Month","Ingredient"], as_index=False)
+@st.cache_data(show_spinner=False)
+def build_combined(sales, ingr, ship):
+    # unify categories so the merges stay on integer codes instead of object
+    # fallback; cast via assign so the cached arguments are never mutated
+    item_dtype = pd.CategoricalDtype(sales["Item Name"].cat.categories
+                                     .union(ingr["Item Name"].cat.categories))
+    ing_dtype  = pd.CategoricalDtype(ingr["Ingredient"].cat.categories
+                                     .union(ship["Ingredient"].cat.categories))
+    sales = sales.assign(**{"Item Name": sales["Item Name"].astype(item_dtype)})
+    ingr  = ingr.assign(**{"Item Name":  ingr["Item Name"].astype(item_dtype),
+                           "Ingredient": ingr["Ingredient"].astype(ing_dtype)})
+    ship  = ship.assign(Ingredient=ship["Ingredient"].astype(ing_dtype))
+
+    # inner merge drops items with no ingredient mapping, so no dropna pass needed
+    m = sales.merge(ingr, on="Item Name", how="inner", validate="m:m")
+    m["IngredientUsage"] = (m["Count"].to_numpy() * m["Units per Item"].to_numpy()).astype(np.float32)
+    usage_by_month_ing = (m.groupby(["Month","Ingredient"], as_index=False,
+                                    sort=False, observed=True)
                            .agg(TotalUsed=("IngredientUsage","sum"),
                                 Orders=("Count","sum")))
 
-combined = usage_by_month_ing.merge(
-    ship[["Ingredient","TotalReceived","WeeklySupply","Unit"]],
-    on="Ingredient", how="left"
-)
-
-# simple forecast
-combined = combined.sort_values(["Ingredient","Month"]).copy()
-combined["ForecastNextMonth"] = (combined.groupby("Ingredient")["TotalUsed"]
-                                 .transform(lambda s: s.rolling(3, min_periods=1).mean()))
-combined["Gap_Received_vs_Used"] = combined["TotalUsed"] - combined["TotalReceived"]
-combined["ReorderFlag"] = np.where(combined["ForecastNextMonth"] > combined["TotalReceived"], "Reorder Soon","OK")
+    # one row per ingredient, so the merge can't multiply rows across months
+    ship_per_ing = (ship.groupby("Ingredient", as_index=False, sort=False, observed=True)
+                        .agg(TotalReceived=("TotalReceived","sum"),
+                             WeeklySupply=("WeeklySupply","sum"),
+                             Unit=("Unit","first")))
+    combined = usage_by_month_ing.merge(ship_per_ing, on="Ingredient",
+                                        how="left", validate="m:1")
+
+    # simple forecast
+    combined = combined.sort_values(["Ingredient","Month"]).copy()
+    combined["ForecastNextMonth"] = _grouped_roll3_mean(
+        combined["TotalUsed"].to_numpy(dtype=np.float64),
+        combined["Ingredient"].cat.codes.to_numpy()).astype(np.float32)
+    combined["Gap_Received_vs_Used"] = combined["TotalUsed"] - combined["TotalReceived"]
+    needs_reorder = (combined["ForecastNextMonth"].to_numpy()
+                     > combined["TotalReceived"].to_numpy())
+    combined["ReorderFlag"] = pd.Categorical.from_codes(
+        needs_reorder.astype(np.int8), categories=["OK","Reorder Soon"])
+    return combined
+
+combined = build_combined(sales, ingr, ship)
+
+# counts categorical codes over ~dozens of rows — cheap, and it matches what
+# the dashboard actually shows (map-only ingredients never reach combined)
+n_ingredients = int(combined["Ingredient"].nunique())
 
 # ---------- KPIs ----------
 total_sales  = sales["Amount"].sum()
@@ -177,35 +302,53 @@ total_orders = sales["Count"].sum()
 c1,c2,c3 = st.columns(3)
 c1.metric("Total Sales ($)", f"{total_sales:,.0f}")
 c2.metric("Total Orders", f"{total_orders:,.0f}")
-c3.metric("Ingredients Tracked", f"{combined['Ingredient'].nunique():,}")
+c3.metric("Ingredients Tracked", f"{n_ingredients:,}")
 st.markdown("---")
 
 # ---------- Charts ----------
+@st.cache_data(show_spinner=False)
+def _agg_and_trend(combined, top_n):
+    agg = (combined.groupby("Ingredient", as_index=False, sort=False, observed=True)
+                   .agg(Used=("TotalUsed","sum"), Received=("TotalReceived","max")))
+    agg["UsageRate%"] = np.where(agg["Received"]>0, (agg["Used"]/agg["Received"])*100, np.nan)
+
+    # cap what Plotly has to serialize: top-N by usage plus one "Others" bucket
+    if len(agg) > top_n:
+        topk = agg.nlargest(top_n, "Used")
+        others = pd.DataFrame([{"Ingredient": "Others",
+                                "Used": agg["Used"].sum() - topk["Used"].sum(),
+                                "Received": agg["Received"].sum() - topk["Received"].sum(),
+                                "UsageRate%": np.nan}])
+        chart_agg = pd.concat([topk, others], ignore_index=True)
+    else:
+        chart_agg = agg
+    rate = agg.sort_values("UsageRate%", ascending=False).head(top_n)
+    trend = combined.groupby("Month", as_index=False).agg(TotalUsed=("TotalUsed","sum"))
+    return agg, chart_agg, rate, trend
+
+top_n = st.sidebar.slider("Top N ingredients", 10, 200, 25)
 col1, col2 = st.columns((2,1))
-agg = combined.groupby("Ingredient", as_index=False).agg(Used=("TotalUsed","sum"),
-                                                         Received=("TotalReceived","max"))
+agg, chart_agg, rate, trend = _agg_and_trend(combined, top_n)
 
 with col1:
     if not agg.empty:
-        fig1 = px.bar(agg.melt(id_vars="Ingredient", value_vars=["Used","Received"],
-                               var_name="Type", value_name="Qty"),
-                      x="Ingredient", y="Qty", color="Type", barmode="group",
-                      title="📦 Received vs Used by Ingredient")
-        fig1.update_xaxes(tickangle=45)
+        # wide form straight into go.Bar — no melt, half the serialized payload
+        fig1 = go.Figure([
+            go.Bar(name="Used",     x=chart_agg["Ingredient"], y=chart_agg["Used"]),
+            go.Bar(name="Received", x=chart_agg["Ingredient"], y=chart_agg["Received"]),
+        ])
+        fig1.update_layout(barmode="group", title="📦 Received vs Used by Ingredient",
+                           xaxis_tickangle=45)
         st.plotly_chart(fig1, use_container_width=True)
     else:
         st.info("No data to display (check filters and input).")
 
 with col2:
     if not agg.empty:
-        agg["UsageRate%"] = np.where(agg["Received"]>0, (agg["Used"]/agg["Received"])*100, np.nan)
-        fig2 = px.bar(agg.sort_values("UsageRate%", ascending=False),
+        fig2 = px.bar(rate,
                       x="UsageRate%", y="Ingredient", orientation="h",
                       title="⚙️ Usage Efficiency (%)")
         st.plotly_chart(fig2, use_container_width=True)
-
-trend = (usage_by_month_ing.groupby("Month", as_index=False)
-                             .agg(TotalUsed=("TotalUsed","sum")))
 if not trend.empty:
     st.plotly_chart(px.line(trend, x="Month", y="TotalUsed", markers=True,
                             title="📈 Total Ingredient Usage Over Time"),
@@ -218,9 +361,21 @@ st.dataframe(combined[["Month","Ingredient","TotalUsed","TotalReceived",
              .sort_values(["ReorderFlag","Ingredient","Month"]),
              use_container_width=True)
 
+@st.cache_data(show_spinner=False)
+def _to_csv_bytes(df):
+    try:
+        import pyarrow as pa
+        import pyarrow.csv as pacsv
+        buf = io.BytesIO()
+        pacsv.write_csv(pa.Table.from_pandas(df, preserve_index=False), buf)
+        return buf.getvalue()
+    except Exception:
+        # pyarrow missing or can't handle a dtype — pandas writer still works
+        return df.to_csv(index=False).encode("utf-8")
+
 st.download_button(
     "⬇️ Download Combined (CSV)",
-    data=combined.to_csv(index=False),
+    data=_to_csv_bytes(combined),
     file_name="MSY_Combined.csv",
     mime="text/csv"
 )